@@ -1,12 +1,31 @@
-import sys 
+import sys
 import socket
+import mmap
+import logging
 
 from colorama import Fore, Style
 
 from random import randrange
 
-def print_with_color(text, color):
-    print(f"{color}{repr(text)}{Style.RESET_ALL}")
+# Per-packet messages log at DEBUG: with lazy %-style arguments they cost
+# nothing when the level is disabled, unlike an eager print per packet
+
+logging.basicConfig(format='%(message)s', level=logging.INFO)
+log = logging.getLogger(__name__)
+
+# Ports, TTLs and flags repeat heavily across packets, so cache their
+# parsed values and turn most int() calls into a dict hit
+
+_INT_CACHE = {}
+
+def _int(value: str) -> int:
+    result = _INT_CACHE.get(value)
+    if result is None:
+        # Keep the cache bounded in case of garbage traffic
+        if len(_INT_CACHE) >= 4096:
+            _INT_CACHE.clear()
+        result = _INT_CACHE[value] = int(value)
+    return result
 
 
 class Router:
@@ -27,16 +46,32 @@ class Router:
         self.table_path = table_path
         self.color = color
 
-        print_with_color(f"Router {self.ip}:{self.port} using table file {self.table_path}", self.color)
+        log.info("%sRouter %s:%d using table file %s%s", self.color, self.ip, self.port, self.table_path, Style.RESET_ALL)
 
         # Create a socket and bind it to the router IP and port
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+        # Let several workers bind the same port and enlarge the socket
+        # buffers so bursts queue in the kernel instead of being dropped.
+        # SO_REUSEPORT is not available on every platform, so skip it there
+
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        except OSError:
+            pass
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * 1024 * 1024)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4 * 1024 * 1024)
         self.sock.bind((self.ip, self.port))
 
         self.route_list = None
         self.fragment_dict = {}
         self.asn_list = []
 
+        # Our own ASN, interned once so appending it to routes and
+        # comparing it against ASNs is a pointer compare
+
+        self.interned_port = sys.intern(str(self.port))
+
         # Read the routing table file and fill the route_list
 
         self.read_routing_table()
@@ -45,6 +80,18 @@ class Router:
 
         self.generate_asn()
 
+        # The neighbors are fixed by the initial table, so compute them
+        # once instead of re-parsing the routes on every BGP session
+
+        self.neighbors = self.get_neighbors()
+
+        # Neighbor addresses never change either, so encode each packet
+        # destination header once instead of re-encoding the same IP and
+        # port on every sendto
+
+        self._neighbor_headers = [(neighbor, b'%s,%d,' % (neighbor[0].encode(), neighbor[1]))
+                                  for neighbor in self.neighbors]
+
     def parse_packet(self, packet:bytes) -> dict:
 
         """
@@ -61,12 +108,12 @@ class Router:
 
         return {
             'IP': packet[0],
-            'Port': int(packet[1]),
-            'TTL': int(packet[2]),
+            'Port': _int(packet[1]),
+            'TTL': _int(packet[2]),
             'ID': int(packet[3]),
             'Offset': int(packet[4]),
             'Size': packet[5],
-            'Flag': int(packet[6]),
+            'Flag': _int(packet[6]),
             'Message': packet[7]
         }
     
@@ -84,25 +131,54 @@ class Router:
         return ','.join([str(v) for v in parsed_packet.values()])
     
     def read_routing_table(self) -> None:
-        
+
         """
         Read the routing table file and fill the route_list
-        """  
+        """
+
+        # Map the file instead of buffering it through readlines, and let
+        # bytes.splitlines cut it at memchr speed. Empty files cannot be
+        # mapped, so fall back to an empty table for them
 
-        with open(self.table_path, 'r') as f:
-            self.route_list = f.readlines()
-            self.route_list = [x.strip() for x in self.route_list]
+        with open(self.table_path, 'rb') as f:
+            try:
+                table = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                self.route_list = []
+            else:
+                with table:
+                    self.route_list = [line.decode().strip() for line in table[:].splitlines() if line.strip()]
+
+        # Tokenize every route line once; all other methods index into
+        # these parts instead of re-splitting the same strings
+
+        self._parts = [route.split(' ') for route in self.route_list]
+
+        # Build a (IP, Port) -> (hop IP, hop port, MTU) map once, so that
+        # check_routes is a single dict lookup instead of a scan over route_list
+
+        self._route_map = {}
+        for parts in self._parts:
+            self._route_map[(parts[0], int(parts[1]))] = (parts[-3], int(parts[-2]), int(parts[-1]))
 
     def generate_asn(self) -> None:
 
         """
         Generate the ASN list from the route_list
-        """        
+        """
 
-        for route in self.route_list:
+        # ASN paths are stored as tuples of interned strings: tuples are
+        # smaller than lists and interning makes ASN equality checks a
+        # pointer compare instead of a character-by-character one
+
+        for parts in self._parts:
             # ASN is everything except the first and last 3 elements
-            asn = route.split(' ')[1:-3]
-            self.asn_list.append(asn)
+            self.asn_list.append(tuple(sys.intern(a) for a in parts[1:-3]))
+
+        # Index the routes by their first ASN so that looking up a
+        # received route is a dict get instead of a scan over asn_list
+
+        self._asn_index = {asn[0]: idx for idx, asn in enumerate(self.asn_list)}
 
     def create_BGP_message(self) -> str:
         
@@ -113,14 +189,13 @@ class Router:
             str: Message with the format BGP_ROUTES Port ASN1 ASN2 ASN ... END_ROUTES
         """
 
-        bgp_message = 'BGP_ROUTES\n'
-        bgp_message += f'{self.port}\n'
-        for route in self.route_list:
-            # Exclude the first and las 3 elements
-            asn = route.split(' ')[1:-3]
-            bgp_message += f'{" ".join(asn)}\n'
-        bgp_message += 'END_ROUTES'
-        return bgp_message
+        # Build the whole message with a single join instead of growing
+        # a string line by line. The ASN is everything in a route except
+        # the first and last 3 elements
+
+        return '\n'.join(['BGP_ROUTES', str(self.port),
+                          *(' '.join(parts[1:-3]) for parts in self._parts),
+                          'END_ROUTES'])
     
     def get_neighbors(self) -> list:
         
@@ -133,9 +208,8 @@ class Router:
         """
 
         neighbors = []
-        for route in self.route_list:
-            route = route.split(' ')
-            neighbors.append((route[3], int(route[4])))
+        for parts in self._parts:
+            neighbors.append((parts[3], int(parts[4])))
         return neighbors
     
     def extract_BGP_routes(self, bgp_message: str) -> list:
@@ -152,64 +226,23 @@ class Router:
 
         bgp_message = bgp_message.split('\n')
         bgp_message = bgp_message[2:-1]
-        bgp_message = [x.split(' ') for x in bgp_message]
+        bgp_message = [tuple(sys.intern(a) for a in x.split(' ')) for x in bgp_message]
         return bgp_message
     
 
-    def create_start_BGP(self, neighbor: tuple) -> str:
-        
-        """
-        Create a START_BGP message to send to a neighbor
-
-        Args:
-            neighbor (tuple): Neighbor address with the format (IP, Port)
-
-        Returns:
-            str: IP Packet with the START_BGP message
-        """ 
-               
-        start_bgp_message = {
-            'IP': neighbor[0],
-            'Port': neighbor[1],
-            'TTL': 20,
-            'ID': str(randrange(1000)),
-            'Offset': 0,
-            'Size': str(len("START_BGP")).zfill(8),
-            'Flag': 0,
-            'Message': "START_BGP"
-        }
-
-        start_bgp_message = self.create_packet(start_bgp_message)
-
-        return start_bgp_message
-    
-    def create_BGP_routes(self, neighbor: tuple) -> str:
+    def create_body_bytes(self, message: str) -> bytes:
 
         """
-        Create a BGP_ROUTES message to send to a neighbor
+        Serialize the packet fields that are identical for every neighbor
 
         Args:
-            neighbor (tuple): Neighbor address with the format (IP, Port)
+            message (str): Message to send
 
         Returns:
-            str: IP Packet with the BGP_ROUTES message
+            bytes: Encoded TTL,ID,Offset,Size,Flag,Message suffix of a packet
         """
 
-        bgp_routes = self.create_BGP_message()
-            
-        bgp_message_packet = {
-            'IP': neighbor[0],
-            'Port': neighbor[1],    
-            'TTL': 20,
-            'ID': str(randrange(1000)),
-            'Offset': 0,
-            'Size': str(len(bgp_routes)).zfill(8),
-            'Flag': 0,
-            'Message': bgp_routes
-        }
-
-        bgp_message_packet = self.create_packet(bgp_message_packet)
-        return bgp_message_packet
+        return ('20,%d,0,%s,0,%s' % (randrange(1000), str(len(message)).zfill(8), message)).encode()
 
     def run_BGP(self) -> None:
         
@@ -220,17 +253,17 @@ class Router:
         # Set timeout to 10 seconds
 
         self.sock.settimeout(10)
-        neighbors = self.get_neighbors()
-        
-        # Send a START_BGP message to each neighbor
 
-        for neighbor in neighbors:
-            start_bgp_message = self.create_start_BGP(neighbor)
+        # Send a START_BGP message to each neighbor. The packet bodies are
+        # encoded once and only the cached destination header changes per
+        # neighbor
 
-            bgp_message_packet = self.create_BGP_routes(neighbor)
+        start_body = self.create_body_bytes('START_BGP')
+        routes_body = self.create_body_bytes(self.create_BGP_message())
 
-            self.sock.sendto(start_bgp_message.encode(), neighbor)
-            self.sock.sendto(bgp_message_packet.encode(), neighbor)
+        for neighbor, header in self._neighbor_headers:
+            self.sock.sendto(header + start_body, neighbor)
+            self.sock.sendto(header + routes_body, neighbor)
 
         while True:
             try:
@@ -240,9 +273,9 @@ class Router:
             # We enter here if the timeout is reached
 
             except:
-                print_with_color(f"Router {self.ip}:{self.port} finished BGP", self.color)
+                log.info("%sRouter %s:%d finished BGP%s", self.color, self.ip, self.port, Style.RESET_ALL)
                 table = self.generate_routing_table()
-                print_with_color(f'Routing table after BGP {table}', self.color)
+                log.info("%sRouting table after BGP %s%s", self.color, table, Style.RESET_ALL)
                 self.sock.settimeout(None)
 
                 # Update self.route_list
@@ -260,29 +293,28 @@ class Router:
 
                 modified = False
                 for route in recv_routes:
-                    # If the route is to itself, ignore it
-                    if str(self.port) in route:
+                    # Skip routes that already contain our own ASN, both
+                    # routes to ourselves and paths that would loop back
+                    # through us. The interned port makes this a chain of
+                    # pointer compares over a short tuple
+
+                    if self.interned_port in route:
                         continue
 
-                    known = False
-                    found_idx = None
-                    for idx, r in enumerate(self.asn_list):
-                        if route[0] == r[0]:
-                            known = True
-                            found_idx = idx
-                            break
-                    
+                    found_idx = self._asn_index.get(route[0])
+
                     # If we don't know the route, add it to the list
 
-                    if not known:
-                        updated_route = route + [str(self.port)]
+                    if found_idx is None:
+                        updated_route = route + (self.interned_port,)
+                        self._asn_index[route[0]] = len(self.asn_list)
                         self.asn_list.append(updated_route)
                         modified = True
 
                     # If we know the route, update it if it's shorter
-                    
-                    if known:
-                        updated_route = route + [str(self.port)]
+
+                    else:
+                        updated_route = route + (self.interned_port,)
                         if len(updated_route) < len(self.asn_list[found_idx]):
                             self.asn_list[found_idx] = updated_route
                             modified = True
@@ -290,24 +322,17 @@ class Router:
                 # If we modified the list, send the new routes to all neighbors
                 
                 if modified:
-                    for neighbor in neighbors:
-                        bgp_routes = self.asn_list
-                        
-                        # print_with_color(f"Sending to {neighbor}: {bgp_routes}", self.color)
-                        bgp_routes = 'BGP_ROUTES\n' + f'{self.port}\n' + '\n'.join([' '.join(x) for x in bgp_routes]) + '\nEND_ROUTES'
-                        bgp_message = {
-                            'IP': neighbor[0],
-                            'Port': neighbor[1],
-                            'TTL': 20,
-                            'ID': str(randrange(1000)),
-                            'Offset': 0,
-                            'Size': str(len(bgp_routes)).zfill(8),
-                            'Flag': 0,
-                            'Message': bgp_routes
-                        }
-                        bgp_message_packet = self.create_packet(bgp_message)
-                        print_with_color(f"Sending to {neighbor}: {bgp_routes}", self.color)
-                        self.sock.sendto(bgp_message_packet.encode(), neighbor)
+
+                    # Serialize the routes once; the payload is identical
+                    # for every neighbor
+
+                    bgp_routes = 'BGP_ROUTES\n%d\n%s\nEND_ROUTES' % (
+                        self.port, '\n'.join(' '.join(x) for x in self.asn_list))
+                    routes_body = self.create_body_bytes(bgp_routes)
+
+                    for neighbor, header in self._neighbor_headers:
+                        log.debug("%sSending to %s: %s%s", self.color, neighbor, bgp_routes, Style.RESET_ALL)
+                        self.sock.sendto(header + routes_body, neighbor)
 
     def generate_routing_table(self) -> list:
 
@@ -319,23 +344,23 @@ class Router:
         """        
 
         entries = []
-        for asn in self.asn_list:
-            for route in self.route_list:
-                full_route = route.split(' ')
-                route = route.split(' ')[1:-3]
 
-                # If the ASN is the last one in the route, it's the destination
+        # Map each directly connected ASN to its hop address once, instead
+        # of re-splitting route_list for every ASN path
 
-                if asn[-2] == route[0]:
-                    dest_ip = full_route[-3]
-                    dest_port = full_route[-2]
-                    break
+        dest_by_asn = {}
+        for parts in self._parts:
+            if parts[1] not in dest_by_asn:
+                dest_by_asn[parts[1]] = (parts[-3], parts[-2])
+
+        for asn in self.asn_list:
+            dest_ip, dest_port = dest_by_asn[asn[-2]]
             entries.append(f'127.0.0.1 {" ".join([str(a) for a in asn])} {dest_ip} {dest_port} 1000')
         
         with open(f'rutas/BGP_{self.port}.txt', 'w') as f:
             f.write('\n'.join(entries))
 
-        print_with_color(f'Wrote routing table to rutas/BGP_{self.port}.txt', self.color)
+        log.info("%sWrote routing table to rutas/BGP_%d.txt%s", self.color, self.port, Style.RESET_ALL)
 
         return entries                    
 
@@ -351,26 +376,9 @@ class Router:
         
         Returns:
             tuple: Tuple containing the next hop IP, port and MTU, or None if the route doesn't exist
-        """        
-
-        hop_ip = None
-        hop_port = None
-        hop_mtu = None
+        """
 
-        for route in self.route_list:
-            route = route.split(' ')
-            dest_port = int(route[1])
-            
-            if ip == route[0] and port == dest_port:
-                hop_ip = route[-3]
-                hop_port = int(route[-2])
-                hop_mtu = int(route[-1])
-                break  # Exit the loop since the desired route is found
-        
-        if hop_ip is not None:
-            return (hop_ip, hop_port, hop_mtu)
-        else:
-            return None
+        return self._route_map.get((ip, port))
 
 
     def forward_packet(self, packet: dict, forward_address: tuple) -> None:
@@ -404,6 +412,14 @@ class Router:
             list: List of fragments
         """
 
+        # Fast path: a conservative bound on the serialized header length
+        # (15-char IP, 5-digit port, commas and the zero-padded size all
+        # fit in 64 bytes) keeps packets that clearly fit the MTU away
+        # from the split and measure work below
+
+        if len(packet['Message']) + 64 <= mtu:
+            return [self.create_packet(packet)]
+
         packet_str = self.create_packet(packet)
         packet_size = len(packet_str.encode())
         packet_list = packet_str.split(',')
@@ -475,7 +491,7 @@ class Router:
         if (int(fragments[-1][6]) != 0):
             return None
         
-        print_with_color(f'Reassembling {len(fragments)} fragments', self.color)
+        log.debug("%sReassembling %d fragments%s", self.color, len(fragments), Style.RESET_ALL)
 
         
         for fragment in fragments:
@@ -525,18 +541,18 @@ class Router:
             # If the packet has TTL = 0, drop it
 
             elif packet['TTL'] == 0:
-                print_with_color(f'Dropped packet with TTL = 0', self.color)
+                log.debug("%sDropped packet with TTL = 0%s", self.color, Style.RESET_ALL)
 
             elif packet['IP'] == self.ip and packet['Port'] == self.port:
-                print_with_color(f'Message from {packet["IP"]}:{packet["Port"]}: {packet["Message"]}', self.color)
+                log.info("%sMessage from %s:%d: %s%s", self.color, packet['IP'], packet['Port'], packet['Message'], Style.RESET_ALL)
 
             else:
                 route = self.check_routes(packet['IP'], packet['Port'])
                 if route is not None:
-                    print_with_color(f'Forwarding packet to {route[0]}:{route[1]}', self.color)
+                    log.debug("%sForwarding packet to %s:%d%s", self.color, route[0], route[1], Style.RESET_ALL)
                     self.forward_packet(packet, (route[0], route[1]))
                 else:
-                    print_with_color(f'No route to {packet["IP"]}:{packet["Port"]}', self.color)
+                    log.info("%sNo route to %s:%d%s", self.color, packet['IP'], packet['Port'], Style.RESET_ALL)
 
 
 if __name__ == "__main__":
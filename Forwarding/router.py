@@ -1,11 +1,36 @@
-import sys 
+import sys
 import socket
+import logging
+
+from collections import deque
 
 from colorama import Fore, Style
 
-def print_with_color(text, color):
-    print(f"{color}{repr(text)}{Style.RESET_ALL}")
-    
+from udp_batch import recv_batch
+
+# Per-packet messages log at DEBUG: with lazy %-style arguments they cost
+# nothing when the level is disabled, unlike an eager print per packet
+
+logging.basicConfig(format='%(message)s', level=logging.INFO)
+log = logging.getLogger(__name__)
+
+# Shared empty port table, returned when a destination IP is unknown
+NO_ROUTES = [None] * 65536
+
+# Ports and TTLs repeat heavily across packets, so cache their parsed
+# values and turn most int() calls into a dict hit
+
+_INT_CACHE = {}
+
+def _int(value: str) -> int:
+    result = _INT_CACHE.get(value)
+    if result is None:
+        # Keep the cache bounded in case of garbage traffic
+        if len(_INT_CACHE) >= 4096:
+            _INT_CACHE.clear()
+        result = _INT_CACHE[value] = int(value)
+    return result
+
 
 class Router:
     def __init__(self, ip: str, port: int, table_path: str, color = Fore.WHITE) -> None:
@@ -25,51 +50,45 @@ class Router:
         self.table_path = table_path
         self.color = color
 
-        print_with_color(f"Router {self.ip}:{self.port} using table file {self.table_path}", self.color)
+        log.info("%sRouter %s:%d using table file %s%s", self.color, self.ip, self.port, self.table_path, Style.RESET_ALL)
 
         # Create a socket and bind it to the router IP and port
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+        # Let several workers bind the same port and enlarge the socket
+        # buffers so bursts queue in the kernel instead of being dropped.
+        # SO_REUSEPORT is not available on every platform, so skip it there
+
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        except OSError:
+            pass
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * 1024 * 1024)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4 * 1024 * 1024)
         self.sock.bind((self.ip, self.port))
 
         self.route_list = None
 
+        # The packet layout is fixed for this router type, so generate the
+        # parser and serializer once with exec. The resulting functions are
+        # plain module-level style functions: straight-line bytecode with
+        # no attribute lookups or generic per-field loops on the hot path
+
+        ns = {'_int': _int}
+        exec(
+            "def _parse(packet):\n"
+            "    ip, port, message = packet.decode().split(',', 2)\n"
+            "    return {'IP': ip, 'Port': _int(port), 'Message': message}\n"
+            "def _create(parsed_packet):\n"
+            "    return '%s,%d,%s' % (parsed_packet['IP'], parsed_packet['Port'], parsed_packet['Message'])\n",
+            ns)
+        self.parse_packet = ns['_parse']
+        self.create_packet = ns['_create']
+
         # Read the routing table file and fill the route_list
 
         self.read_routing_table()
 
-    def parse_packet(self, packet:bytes) -> dict:
-
-        """
-        Parse a packet into a dictionary
-
-        Args:
-            packet (bytes): Packet to parse. Each packet has the format IP,Port,Message
-        Returns:
-            dict: Dictionary with the packet information
-        """        
-
-        packet = packet.decode()
-        packet = packet.split(',')
-
-        return {
-            'IP': packet[0],
-            'Port': int(packet[1]),
-            'Message': packet[2]
-        }
-    
-    def create_packet(self, parsed_packet:dict) -> str:
-
-        """
-        Create a packet from a dictionary
-
-        Args:
-            parsed_packet (dict): Dictionary with the packet information
-        Returns:
-            str: Packet with the format IP,Port,Message
-        """        
-
-        return f"{parsed_packet['IP']},{parsed_packet['Port']},{parsed_packet['Message']}"
-    
     def read_routing_table(self) -> None:
 
         """
@@ -80,6 +99,27 @@ class Router:
             self.route_list = f.readlines()
             self.route_list = [x.strip() for x in self.route_list]
 
+        # Expand the port ranges into a per-IP table indexed by port, so that
+        # check_routes is a single lookup instead of a scan over route_list
+
+        self._port_table = {}
+        for route in self.route_list:
+            route = route.split(' ')
+
+            port_low = int(route[1])
+            port_high = int(route[2])
+            hop = (route[3], int(route[4]))
+
+            # Each slot holds a deque of every hop whose range covers the
+            # port, in table order, so check_routes can round-robin
+            # between them by rotating the deque
+
+            table = self._port_table.setdefault(route[0], [None] * 65536)
+            for port in range(port_low, port_high + 1):
+                if table[port] is None:
+                    table[port] = deque()
+                table[port].append(hop)
+
     def check_routes(self, ip: str, port: int) -> bool:
 
         """_
@@ -89,26 +129,25 @@ class Router:
             ip (str): IP of the destination
             port (int): Port of the destination
         Returns:
-            bool: True if there is a route, False otherwise
-        """ 
+            tuple: The (hop IP, hop port) of the next hop, None if there is no route
+        """
 
-        for route in self.route_list:
-            route = route.split(' ')
-            
-            port_low = int(route[1])
-            port_high = int(route[2])
-            if ip == route[0] and port in range(port_low, port_high + 1):
+        # Ports outside the table range come from malformed packets and
+        # simply have no route
 
-                hop_ip = route[3]
-                hop_port = int(route[4])
+        if not 0 <= port < 65536:
+            return None
 
-                print_with_color(f"Removing route {route}", self.color)
-                # Move the route to the end of the list
-                self.route_list.remove(' '.join(route))
-                self.route_list.append(' '.join(route))
+        hops = self._port_table.get(ip, NO_ROUTES)[port]
+        if hops is None:
+            return None
 
-                return (hop_ip, hop_port)
-        return None
+        # Round-robin between the hops covering the port: take the first
+        # one and rotate it to the back
+
+        hop = hops[0]
+        hops.rotate(-1)
+        return hop
 
     def forward_packet(self, packet: dict, forward_address: tuple) -> None:
             
@@ -127,41 +166,69 @@ class Router:
             # Send the packet to the next hop
             self.sock.sendto(packet.encode(), forward_address)
 
-    def run(self) -> None:
+    def handle_packet(self, packet: bytes) -> None:
 
         """
-        Main loop of the router. It waits for packets and forwards them if necessary
-        """        
+        Handle a single received datagram, printing or forwarding it
 
-        # Wait in a loop for packets
+        Args:
+            packet (bytes): Raw datagram received from the socket
+        """
 
-        while True:
-            packet, _ = self.sock.recvfrom(1024)
-            packet = self.parse_packet(packet)
+        packet = self.parse_packet(packet)
 
-            print_with_color(f"Received packet: {packet}", self.color)
+        log.debug("%sReceived packet: %s%s", self.color, packet, Style.RESET_ALL)
 
-            # If the packet is for the router, print it
+        # If the packet is for the router, print it
 
-            if packet['IP'] == self.ip and packet['Port'] == self.port:
-                print_with_color(f"Message from {packet['IP']}:{packet['Port']}: {packet['Message']}", self.color)
+        if packet['IP'] == self.ip and packet['Port'] == self.port:
+            log.info("%sMessage from %s:%d: %s%s", self.color, packet['IP'], packet['Port'], packet['Message'], Style.RESET_ALL)
 
+        else:
+
+            # Check if there is a route to the destination address
+
+            route = self.check_routes(packet['IP'], int(packet['Port']))
+
+            # If there is a route, forward the packet
+
+            if route:
+                log.debug("%sRedirecting message for %s:%d to %s:%d%s", self.color, packet['IP'], packet['Port'], route[0], route[1], Style.RESET_ALL)
+                self.forward_packet(packet, route)
             else:
 
-                # Check if there is a route to the destination address
+                # No route found, print the error
 
-                route = self.check_routes(packet['IP'], int(packet['Port']))
+                log.info("%sNo routes found to %s:%d%s", self.color, packet['IP'], packet['Port'], Style.RESET_ALL)
 
-                # If there is a route, forward the packet
+    def handle_readable(self) -> None:
 
-                if route:
-                    print_with_color(f"Redirecting message for {packet['IP']}:{packet['Port']} to {route[0]}:{route[1]}", self.color)
-                    self.forward_packet(packet, route)
-                else:
+        """
+        Drain one batch of datagrams from the socket. Called by the run
+        loop and by the selector reactor in run_all when the socket is
+        readable
+        """
 
-                    # No route found, print the error
+        # A malformed datagram must only cost itself, not the rest of
+        # its batch or the reactor, so errors are logged and the drain
+        # moves on to the next packet
 
-                    print_with_color(f"No routes found to {packet['IP']}:{packet['Port']}", self.color)
+        for packet in recv_batch(self.sock):
+            try:
+                self.handle_packet(packet)
+            except Exception:
+                log.exception("%sError handling packet%s", self.color, Style.RESET_ALL)
+
+    def run(self) -> None:
+
+        """
+        Main loop of the router. It waits for packets and forwards them if necessary
+        """
+
+        # Wait in a loop for batches of packets
+
+        while True:
+            self.handle_readable()
 
 
 if __name__ == '__main__':
@@ -1,10 +1,32 @@
-import sys 
+import sys
 import socket
+import logging
+
+from collections import deque
 
 from colorama import Fore, Style
 
-def print_with_color(text, color):
-    print(f"{color}{repr(text)}{Style.RESET_ALL}")
+from udp_batch import recv_batch
+
+# Per-packet messages log at DEBUG: with lazy %-style arguments they cost
+# nothing when the level is disabled, unlike an eager print per packet
+
+logging.basicConfig(format='%(message)s', level=logging.INFO)
+log = logging.getLogger(__name__)
+
+# Ports and TTLs repeat heavily across packets, so cache their parsed
+# values and turn most int() calls into a dict hit
+
+_INT_CACHE = {}
+
+def _int(value: str) -> int:
+    result = _INT_CACHE.get(value)
+    if result is None:
+        # Keep the cache bounded in case of garbage traffic
+        if len(_INT_CACHE) >= 4096:
+            _INT_CACHE.clear()
+        result = _INT_CACHE[value] = int(value)
+    return result
 
 
 class Router:
@@ -25,52 +47,45 @@ class Router:
         self.table_path = table_path
         self.color = color
 
-        print_with_color(f"Router {self.ip}:{self.port} using table file {self.table_path}", self.color)
+        log.info("%sRouter %s:%d using table file %s%s", self.color, self.ip, self.port, self.table_path, Style.RESET_ALL)
 
         # Create a socket and bind it to the router IP and port
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+        # Let several workers bind the same port and enlarge the socket
+        # buffers so bursts queue in the kernel instead of being dropped.
+        # SO_REUSEPORT is not available on every platform, so skip it there
+
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        except OSError:
+            pass
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * 1024 * 1024)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4 * 1024 * 1024)
         self.sock.bind((self.ip, self.port))
 
         self.route_list = None
 
+        # The packet layout is fixed for this router type, so generate the
+        # parser and serializer once with exec. The resulting functions are
+        # plain module-level style functions: straight-line bytecode with
+        # no attribute lookups or generic per-field loops on the hot path
+
+        ns = {'_int': _int}
+        exec(
+            "def _parse(packet):\n"
+            "    ip, port, ttl, message = packet.decode().split(',', 3)\n"
+            "    return {'IP': ip, 'Port': _int(port), 'TTL': _int(ttl), 'Message': message}\n"
+            "def _create(parsed_packet):\n"
+            "    return '%s,%d,%d,%s' % (parsed_packet['IP'], parsed_packet['Port'], parsed_packet['TTL'], parsed_packet['Message'])\n",
+            ns)
+        self.parse_packet = ns['_parse']
+        self.create_packet = ns['_create']
+
         # Read the routing table file and fill the route_list
 
         self.read_routing_table()
 
-    def parse_packet(self, packet:bytes) -> dict:
-
-        """
-        Parse a packet into a dictionary
-
-        Args:
-            packet (bytes): Packet to parse. Each packet has the format IP,Port,Message
-        Returns:
-            dict: Dictionary with the packet information
-        """        
-
-        packet = packet.decode()
-        packet = packet.split(',')
-
-        return {
-            'IP': packet[0],
-            'Port': int(packet[1]),
-            'TTL': int(packet[2]),
-            'Message': packet[3]
-        }
-    
-    def create_packet(self, parsed_packet:dict) -> str:
-
-        """
-        Create a packet from a dictionary
-
-        Args:
-            parsed_packet (dict): Dictionary with the packet information
-        Returns:
-            str: Packet with the format IP,Port,Message
-        """        
-
-        return f"{parsed_packet['IP']},{parsed_packet['Port']},{parsed_packet['TTL']},{parsed_packet['Message']}"
-    
     def read_routing_table(self) -> None:
 
         """
@@ -81,6 +96,28 @@ class Router:
             self.route_list = f.readlines()
             self.route_list = [x.strip() for x in self.route_list]
 
+        # Group duplicate (IP, port range) routes into buckets, each with
+        # a deque of candidate next hops. Lines are split and their ports
+        # parsed once here, and the round-robin in check_routes becomes an
+        # O(1) deque rotation instead of list surgery per packet
+
+        buckets = {}
+        order = []
+        for route in self.route_list:
+            parts = route.split(' ')
+            key = (parts[0], int(parts[1]), int(parts[2]))
+            if key not in buckets:
+                buckets[key] = deque()
+                order.append(key)
+            buckets[key].append((parts[3], int(parts[4])))
+
+        self._route_buckets = [(ip, lo, hi, buckets[(ip, lo, hi)]) for ip, lo, hi in order]
+
+        # Flow cache: (IP, port) -> hop deque, filled by check_routes. The
+        # table was just reloaded, so drop any cached buckets
+
+        self._route_cache = {}
+
     def check_routes(self, ip: str, port: int) -> bool:
 
         """_
@@ -90,25 +127,40 @@ class Router:
             ip (str): IP of the destination
             port (int): Port of the destination
         Returns:
-            bool: True if there is a route, False otherwise
-        """        
+            tuple: The (hop IP, hop port) of the next hop, None if there is no route
+        """
 
-        for route in self.route_list:
-            route = route.split(' ')
-            
-            port_low = int(route[1])
-            port_high = int(route[2])
-            if ip == route[0] and port in range(port_low, port_high + 1):
+        # Packets of one flow repeat the same (IP, port), so cache the
+        # matched bucket and skip the scan on repeats. The bucket is
+        # cached rather than the hop, so round-robin keeps rotating
+
+        key = (ip, port)
+        hops = self._route_cache.get(key)
+
+        if hops is None:
+            for route_ip, port_low, port_high, route_hops in self._route_buckets:
+
+                # Compare the port range directly; the cheap int compares
+                # run first and no range object is allocated per route
 
-                hop_ip = route[3]
-                hop_port = int(route[4])
+                if port_low <= port <= port_high and ip == route_ip:
+                    hops = route_hops
+                    break
+            else:
+                return None
+
+            # Keep the cache bounded in case of garbage traffic
 
-                # Move the route to the end of the list
-                self.route_list.remove(' '.join(route))
-                self.route_list.append(' '.join(route))
+            if len(self._route_cache) >= 4096:
+                self._route_cache.clear()
+            self._route_cache[key] = hops
 
-                return (hop_ip, hop_port)
-        return None
+        # Round-robin between the hops of the bucket: take the first one
+        # and rotate it to the back
+
+        hop = hops[0]
+        hops.rotate(-1)
+        return hop
 
     def forward_packet(self, packet: dict, forward_address: tuple) -> None:
             
@@ -129,49 +181,75 @@ class Router:
             # Send the packet to the next hop
             self.sock.sendto(packet.encode(), forward_address)
 
-    def run(self) -> None:
+    def handle_packet(self, packet: bytes) -> None:
 
         """
-        Main loop of the router. It waits for packets and forwards them if necessary
-        """        
+        Handle a single received datagram, printing or forwarding it
 
-        # Wait in a loop for packets
+        Args:
+            packet (bytes): Raw datagram received from the socket
+        """
 
-        while True:
-            packet, _ = self.sock.recvfrom(1024)
-            packet = self.parse_packet(packet)
+        packet = self.parse_packet(packet)
+
+        log.debug("%sReceived packet: %s%s", self.color, packet, Style.RESET_ALL)
+
+        # If the TTL is 0, drop the packet
+
+        if packet['TTL'] == 0:
+            log.debug("%sPacket has TTL = 0, discarding%s", self.color, Style.RESET_ALL)
+            return
 
-            print_with_color(f"Received packet: {packet}", self.color)
+        # If the packet is for the router, print it
 
-            # If the TTL is 0, drop the packet
+        if packet['IP'] == self.ip and packet['Port'] == self.port:
+            log.info("%sMessage from %s:%d: %s%s", self.color, packet['IP'], packet['Port'], packet['Message'], Style.RESET_ALL)
 
-            if packet['TTL'] == 0:
-                print_with_color("Packet has TTL = 0, discarding", self.color)
-                continue
+        else:
 
+            # Check if there is a route to the destination address
+
+            route = self.check_routes(packet['IP'], int(packet['Port']))
+
+            # If there is a route, forward the packet
+
+            if route:
+                log.debug("%sRedirecting message for %s:%d to %s:%d%s", self.color, packet['IP'], packet['Port'], route[0], route[1], Style.RESET_ALL)
+                self.forward_packet(packet, route)
             else:
 
-                # If the packet is for the router, print it
+                # No route found, print the error
 
-                if packet['IP'] == self.ip and packet['Port'] == self.port:
-                    print_with_color(f"Message from {packet['IP']}:{packet['Port']}: {packet['Message']}", self.color)
+                log.info("%sNo routes found to %s:%d%s", self.color, packet['IP'], packet['Port'], Style.RESET_ALL)
 
-                else:
+    def handle_readable(self) -> None:
 
-                    # Check if there is a route to the destination address
+        """
+        Drain one batch of datagrams from the socket. Called by the run
+        loop and by the selector reactor in run_all when the socket is
+        readable
+        """
 
-                    route = self.check_routes(packet['IP'], int(packet['Port']))
+        # A malformed datagram must only cost itself, not the rest of
+        # its batch or the reactor, so errors are logged and the drain
+        # moves on to the next packet
 
-                    # If there is a route, forward the packet
+        for packet in recv_batch(self.sock):
+            try:
+                self.handle_packet(packet)
+            except Exception:
+                log.exception("%sError handling packet%s", self.color, Style.RESET_ALL)
 
-                    if route:
-                        print_with_color(f"Redirecting message for {packet['IP']}:{packet['Port']} to {route[0]}:{route[1]}", self.color)
-                        self.forward_packet(packet, route)
-                    else:
+    def run(self) -> None:
 
-                        # No route found, print the error
+        """
+        Main loop of the router. It waits for packets and forwards them if necessary
+        """
+
+        # Wait in a loop for batches of packets
 
-                        print_with_color(f"No routes found to {packet['IP']}:{packet['Port']}", self.color)
+        while True:
+            self.handle_readable()
 
     
 if __name__ == '__main__':
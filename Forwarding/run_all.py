@@ -1,33 +1,48 @@
 import router_ttl as rttl
 import router as r
-import threading as th
 import sys
+import selectors
 
 from colorama import Fore
 
 
 colors = [Fore.RED, Fore.BLUE, Fore.GREEN, Fore.MAGENTA, Fore.YELLOW, Fore.BLACK, Fore.WHITE]
 
+def serve(routers):
+
+    # One epoll-backed reactor services every router socket from a single
+    # thread: a readable socket gets one batch drained, and there are no
+    # per-router processes to context-switch between
+
+    sel = selectors.DefaultSelector()
+    for router in routers:
+        sel.register(router.sock, selectors.EVENT_READ, router.handle_readable)
+
+    # Per-packet errors are contained inside handle_readable, so a bad
+    # datagram never unwinds the reactor
+
+    while True:
+        for key, _ in sel.select():
+            key.data()
+
 def create_routers(num_routers, version):
-    for i in range(0, num_routers):
-        router = r.Router("127.0.0.1", 8880 + i, f"{version}/rutas_R{i}_{version}.txt", colors[i - 1])
-        thread = th.Thread(target=router.run, args=())
-        thread.start()
+    routers = [r.Router("127.0.0.1", 8880 + i, f"{version}/rutas_R{i}_{version}.txt", colors[i - 1])
+               for i in range(0, num_routers)]
+    serve(routers)
 
 def create_routers_ttl(num_routers, version):
-    for i in range(1, num_routers + 1):
-        router = rttl.Router("127.0.0.1", 8880 + i, f"{version}/rutas_R{i}_{version}.txt", colors[i - 1])
-        thread = th.Thread(target=router.run, args=())
-        thread.start()
+    routers = [rttl.Router("127.0.0.1", 8880 + i, f"{version}/rutas_R{i}_{version}.txt", colors[i - 1])
+               for i in range(1, num_routers + 1)]
+    serve(routers)
 
 if __name__ == "__main__":
     num_router = int(sys.argv[1])
     version = sys.argv[2]
     ttl = int(sys.argv[3])
-    
+
     # If a ttl is specified, create the routers with ttl
 
     if ttl:
         create_routers_ttl(num_router, version)
     else:
-        create_routers(num_router, version)
\ No newline at end of file
+        create_routers(num_router, version)
@@ -0,0 +1,89 @@
+import ctypes
+import ctypes.util
+
+# ctypes binding for Linux recvmmsg, which receives a whole batch of
+# datagrams with a single syscall instead of one recvfrom per packet
+
+class iovec(ctypes.Structure):
+    _fields_ = [
+        ('iov_base', ctypes.c_void_p),
+        ('iov_len', ctypes.c_size_t),
+    ]
+
+class msghdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_name', ctypes.c_void_p),
+        ('msg_namelen', ctypes.c_uint),
+        ('msg_iov', ctypes.POINTER(iovec)),
+        ('msg_iovlen', ctypes.c_size_t),
+        ('msg_control', ctypes.c_void_p),
+        ('msg_controllen', ctypes.c_size_t),
+        ('msg_flags', ctypes.c_int),
+    ]
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_hdr', msghdr),
+        ('msg_len', ctypes.c_uint),
+    ]
+
+# Return once at least one datagram has been received
+
+MSG_WAITFORONE = 0x10000
+
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    _recvmmsg = _libc.recvmmsg
+    _recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    _recvmmsg.restype = ctypes.c_int
+except (OSError, AttributeError, TypeError):
+    _recvmmsg = None
+
+# Reused receive buffer for the recvfrom fallback, so the kernel copies
+# into the same memory every time
+
+_rx_buf = bytearray(2048)
+_rx_view = memoryview(_rx_buf)
+
+def _recv_one(sock) -> list:
+    n, _ = sock.recvfrom_into(_rx_buf)
+    return [bytes(_rx_view[:n])]
+
+
+def recv_batch(sock, n: int = 64, bufsize: int = 1024) -> list:
+
+    """
+    Receive up to n datagrams from a socket with a single recvmmsg syscall
+
+    Blocks until at least one datagram is available. Falls back to a plain
+    recvfrom on platforms without recvmmsg
+
+    Args:
+        sock: Socket to receive from
+        n (int): Maximum number of datagrams per batch
+        bufsize (int): Buffer size for each datagram
+    Returns:
+        list: List of received datagrams as bytes
+    """
+
+    if _recvmmsg is None:
+        return _recv_one(sock)
+
+    bufs = [ctypes.create_string_buffer(bufsize) for _ in range(n)]
+    iovecs = (iovec * n)()
+    hdrs = (mmsghdr * n)()
+
+    for i in range(n):
+        iovecs[i].iov_base = ctypes.cast(bufs[i], ctypes.c_void_p)
+        iovecs[i].iov_len = bufsize
+        hdrs[i].msg_hdr.msg_iov = ctypes.pointer(iovecs[i])
+        hdrs[i].msg_hdr.msg_iovlen = 1
+
+    count = _recvmmsg(sock.fileno(), hdrs, n, MSG_WAITFORONE, None)
+
+    # On any error fall back to recvfrom so the router keeps running
+
+    if count < 0:
+        return _recv_one(sock)
+
+    return [bufs[i].raw[:hdrs[i].msg_len] for i in range(count)]
@@ -0,0 +1,96 @@
+# cython: boundscheck=False, wraparound=False
+
+"""
+Compiled fragment loop for the Fragmentation router.
+
+Build it in place with
+
+    python setup_fast.py build_ext --inplace
+
+router.py picks the extension up automatically and falls back to the
+pure-Python loop when it has not been built
+"""
+
+from libc.string cimport memcpy
+from cpython.bytes cimport PyBytes_FromStringAndSize, PyBytes_AS_STRING
+
+
+# Size of the '!4sHBIIIB' wire header: IP, Port, TTL, ID, Offset, Size, Flag
+
+cdef enum:
+    HDR_SIZE = 20
+
+
+cdef inline void write_header(char *buf, const char *ip, unsigned short port,
+                              unsigned char ttl, unsigned int pid,
+                              unsigned int offset, unsigned int size,
+                              unsigned char flag) noexcept:
+
+    # Big-endian field writes matching the '!4sHBIIIB' layout
+
+    memcpy(buf, ip, 4)
+    buf[4] = <char>(port >> 8)
+    buf[5] = <char>port
+    buf[6] = <char>ttl
+    buf[7] = <char>(pid >> 24)
+    buf[8] = <char>(pid >> 16)
+    buf[9] = <char>(pid >> 8)
+    buf[10] = <char>pid
+    buf[11] = <char>(offset >> 24)
+    buf[12] = <char>(offset >> 16)
+    buf[13] = <char>(offset >> 8)
+    buf[14] = <char>offset
+    buf[15] = <char>(size >> 24)
+    buf[16] = <char>(size >> 16)
+    buf[17] = <char>(size >> 8)
+    buf[18] = <char>size
+    buf[19] = <char>flag
+
+
+def build_fragments(bytes ip, int port, int ttl, unsigned int pid,
+                    unsigned int base_offset, int flag, bytes message, int mtu):
+
+    """
+    Build the wire fragments of a packet, mirroring the pure-Python loop
+    in Router.fragment_IP_packet
+
+    Args:
+        ip (bytes): Packed 4-byte destination IP
+        port (int): Destination port
+        ttl (int): TTL carried by every fragment
+        pid (int): Packet ID
+        base_offset (int): Offset of the message within the full packet
+        flag (int): Flag of the original packet, kept on the last fragment
+        message (bytes): Message to fragment
+        mtu (int): MTU of the outgoing network
+    Returns:
+        list: List of fragments as bytes
+    """
+
+    cdef Py_ssize_t chunk = mtu - HDR_SIZE
+    cdef Py_ssize_t msg_len = len(message)
+    cdef const char *msg = message
+    cdef Py_ssize_t off = 0
+    cdef Py_ssize_t piece
+    cdef bytes frag
+    cdef char *out
+
+    fragments = []
+
+    while off < msg_len:
+        piece = chunk if msg_len - off > chunk else msg_len - off
+
+        # Allocate the final wire bytes once and write header and
+        # payload straight into them
+
+        frag = PyBytes_FromStringAndSize(NULL, HDR_SIZE + piece)
+        out = PyBytes_AS_STRING(frag)
+        write_header(out, ip, <unsigned short>port, <unsigned char>ttl, pid,
+                     base_offset + <unsigned int>off, <unsigned int>piece,
+                     <unsigned char>(flag if off + piece >= msg_len else 1))
+        memcpy(out + HDR_SIZE, msg + off, piece)
+
+        fragments.append(frag)
+        off += piece
+
+    return fragments
@@ -1,15 +1,123 @@
-import sys 
+import os
+import sys
 import socket
+import struct
+import asyncio
+import logging
+import logging.handlers
+import queue
+
+import time
+
+from bisect import bisect_right
+from collections import deque, namedtuple, OrderedDict
 
 from colorama import Fore, Style
 
-def print_with_color(text, color):
-    print(f"{color}{repr(text)}{Style.RESET_ALL}")
+from udp_batch import NUM_RCVMMSGS, BatchReceiver, send_batch
+
+# Compiled fragment loop, used when the optional _fast extension has
+# been built (see setup_fast.py); the pure-Python loop runs otherwise
+
+try:
+    from _fast import build_fragments as _fast_fragments
+except ImportError:
+    _fast_fragments = None
+
+# Per-packet messages log at DEBUG with lazy %-style arguments, and all
+# records go through a queue drained by a listener on a daemon thread,
+# so the packet loop never blocks on a stdout write
+
+_handler = logging.StreamHandler()
+_handler.setFormatter(logging.Formatter('%(message)s'))
+_log_queue = queue.SimpleQueue()
+_listener = logging.handlers.QueueListener(_log_queue, _handler)
+_listener.start()
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.handlers.QueueHandler(_log_queue))
+log.setLevel(logging.INFO)
+
+# The listener thread does not survive a fork, so restart it in worker
+# processes spawned by run_all
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_listener.start)
+
+
+# Fixed binary packet header: IP (packed 4 bytes), Port (u16), TTL (u8),
+# ID, Offset and Size (u32 each) and Flag (u8), followed by the raw
+# message bytes. Parsing is a single struct unpack instead of splitting
+# text and int-converting each field
+
+HDR = struct.Struct('!4sHBIIIB')
+
+# Byte offset of the TTL field within the packed header
+
+TTL_OFFSET = 6
+
+class Packet:
+
+    """
+    Per-packet record with fixed slots. Slots make instances smaller than
+    a dict per packet and attribute access a fixed-offset load, and the
+    fields stay mutable so forwarding can decrement the TTL in place
+    instead of copying the whole record. IP stays as the packed 4-byte
+    address and Message as raw bytes, so packets never have to be decoded
+    when forwarding
+    """
+
+    __slots__ = ('IP', 'Port', 'TTL', 'ID', 'Offset', 'Size', 'Flag', 'Message')
+
+    def __init__(self, IP, Port, TTL, ID, Offset, Size, Flag, Message) -> None:
+        self.IP = IP
+        self.Port = Port
+        self.TTL = TTL
+        self.ID = ID
+        self.Offset = Offset
+        self.Size = Size
+        self.Flag = Flag
+        self.Message = Message
+
+# One port-range bucket of a destination IP: the candidate next hops for
+# ports in [lo, hi], each hop a (hop IP, hop port, MTU) tuple
+
+Route = namedtuple('Route', ['lo', 'hi', 'hops'])
+
+
+# Bounds for in-flight reassemblies: at most MAX_INFLIGHT packet IDs,
+# and an ID whose fragments stop arriving for REASSEMBLY_TIMEOUT seconds
+# is dropped. Lost fragments would otherwise leak buffers forever.
+# MAX_MESSAGE_SIZE caps how far a fragment's claimed Offset + Size may
+# reach: the fields come straight off the wire, so without the cap one
+# tiny datagram could size a reassembly buffer in the gigabytes
+
+MAX_INFLIGHT = 1024
+REASSEMBLY_TIMEOUT = 30.0
+MAX_MESSAGE_SIZE = 1 << 20
+
+
+class _Reassembly:
+
+    """
+    Incremental reassembly state for one packet ID: the message buffer,
+    how many payload bytes have arrived, where the message ends once the
+    last fragment (flag 0) has been seen, and when the reassembly expires
+    """
+
+    __slots__ = ('buffer', 'received_bytes', 'end_offset', 'deadline')
+
+    def __init__(self) -> None:
+        self.buffer = bytearray()
+        self.received_bytes = 0
+        self.end_offset = None
+        self.deadline = 0.0
 
 
 class Router:
-    def __init__(self, ip: str, port: int, table_path: str, color = Fore.WHITE) -> None:
-        
+    def __init__(self, ip: str, port: int, table_path: str, color = Fore.WHITE,
+                 batchsize: int = NUM_RCVMMSGS) -> None:
+
         """
         Initialize a Router object
 
@@ -18,66 +126,111 @@ class Router:
             port (int): Port of the router
             table_path (str): Path to the routing table file
             color: Color for the router prints. Default is white
+            batchsize (int): Maximum datagrams received per syscall
         """
 
         self.ip = ip
+        self.ip_bytes = socket.inet_aton(ip)
         self.port = int(port)
         self.table_path = table_path
         self.color = color
 
-        print_with_color(f"Router {self.ip}:{self.port} using table file {self.table_path}", self.color)
+        log.info("%sRouter %s:%d using table file %s%s", self.color, self.ip, self.port, self.table_path, Style.RESET_ALL)
 
         # Create a socket and bind it to the router IP and port
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+        # Let several workers bind the same port and enlarge the socket
+        # buffers so bursts queue in the kernel instead of being dropped.
+        # SO_REUSEPORT is not available on every platform, so skip it there
+
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        except OSError:
+            pass
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * 1024 * 1024)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4 * 1024 * 1024)
         self.sock.bind((self.ip, self.port))
 
         self.route_list = None
-        self.fragment_dict = {}
+
+        # In-flight reassemblies in least-recently-touched order, so the
+        # oldest entries are the first swept or evicted
+
+        self.fragment_dict = OrderedDict()
+
+        # Preallocate the recvmmsg buffers for the run loop once, so
+        # receiving a batch allocates nothing but the datagram slices
+
+        self._batch = BatchReceiver(self.sock, batchsize)
+
+        # Reused transmit buffer for create_packet; serialized packets
+        # are sent before the next serialization reuses it
+
+        self._tx_buf = bytearray(2048)
+        self._tx_view = memoryview(self._tx_buf)
 
         # Read the routing table file and fill the route_list
 
         self.read_routing_table()
 
-    def parse_packet(self, packet:bytes) -> dict:
+    def peek_header(self, packet: bytes) -> tuple:
+
+        """
+        Unpack only the header fields of a packet
+
+        Args:
+            packet (bytes): Packet to peek into
+        Returns:
+            tuple: (IP, Port, TTL, ID, Offset, Size, Flag), without the message
+        """
+
+        return HDR.unpack_from(packet)
+
+    def parse_packet(self, packet:bytes) -> Packet:
 
         """
-        Parse a packet into a dictionary
+        Parse a packet into a Packet tuple
 
         Args:
-            packet (bytes): Packet to parse. Each packet has the format IP,Port,Message
+            packet (bytes): Packet to parse, a fixed binary header followed by the message
         Returns:
-            dict: Dictionary with the packet information
-        """        
-
-        packet = packet.decode()
-        packet = packet.split(',')
-
-        return {
-            'IP': packet[0],
-            'Port': int(packet[1]),
-            'TTL': int(packet[2]),
-            'ID': int(packet[3]),
-            'Offset': int(packet[4]),
-            'Size': packet[5],
-            'Flag': int(packet[6]),
-            'Message': packet[7]
-        }
-    
-    def create_packet(self, parsed_packet:dict) -> str:
+            Packet: Tuple with the packet information
+        """
+
+        ip, port, ttl, packet_id, offset, size, flag = HDR.unpack_from(packet)
+
+        return Packet(ip, port, ttl, packet_id, offset, size, flag, packet[HDR.size:])
+
+    def create_packet(self, packet: Packet):
 
         """
-        Create a packet from a dictionary
+        Serialize a Packet into the reused transmit buffer
+
+        The returned view stays valid until the next create_packet call,
+        which is enough for callers that send it right away
 
         Args:
-            parsed_packet (dict): Dictionary with the packet information
+            packet (Packet): Packet record with the packet information
         Returns:
-            str: Packet with the format IP,Port,Message
-        """        
+            memoryview: Packed binary header followed by the message bytes
+        """
+
+        size = HDR.size + len(packet.Message)
+
+        # Messages too large for the buffer get their own allocation
+
+        if size > len(self._tx_buf):
+            return HDR.pack(packet.IP, packet.Port, packet.TTL, packet.ID,
+                            packet.Offset, packet.Size, packet.Flag) + packet.Message
+
+        HDR.pack_into(self._tx_buf, 0, packet.IP, packet.Port, packet.TTL, packet.ID,
+                      packet.Offset, packet.Size, packet.Flag)
+        self._tx_buf[HDR.size:size] = packet.Message
+        return self._tx_view[:size]
 
-        return ','.join([str(v) for v in parsed_packet.values()])
-    
     def read_routing_table(self) -> None:
-    
+
         """
         Read the routing table file and fill the route_list
         """
@@ -86,220 +239,390 @@ class Router:
             self.route_list = f.readlines()
             self.route_list = [x.strip() for x in self.route_list]
 
-    def check_routes(self, ip: str, port: int) -> tuple:
+        # Group the routes into per-IP buckets, one bucket per port range,
+        # sorted by the low port. check_routes then binary-searches the
+        # buckets of one IP instead of re-splitting every table line per
+        # packet. Each IP maps to (low ports, buckets) so the bisect runs
+        # over a plain int list. IPs are keyed in their packed 4-byte
+        # form, matching the header field, so lookups hash 4 bytes and
+        # never convert the address back to a string
+
+        buckets = {}
+        for route in self.route_list:
+            parts = route.split(' ')
+            key = (socket.inet_aton(parts[0]), int(parts[1]), int(parts[2]))
+            buckets.setdefault(key, []).append((parts[3], int(parts[4]), int(parts[5])))
+
+        self.routes_by_ip = {}
+        for (ip, lo, hi), hops in sorted(buckets.items()):
+            self.routes_by_ip.setdefault(ip, []).append(Route(lo, hi, deque(hops)))
+
+        self.routes_by_ip = {ip: ([r.lo for r in routes], routes)
+                             for ip, routes in self.routes_by_ip.items()}
+
+        # Flow cache: (IP, port) -> bucket, filled by check_routes. The
+        # table was just reloaded, so drop any cached buckets
+
+        self._route_cache = {}
+
+    def check_routes(self, ip: bytes, port: int) -> tuple:
 
         """_
         Check if there is a route to the destination address. Uses round-robin to select the next hop
 
         Args:
-            ip (str): IP of the destination
+            ip (bytes): Packed IP of the destination
             port (int): Port of the destination
         Returns:
-            bool: True if there is a route, False otherwise
-        """   
+            tuple: The (hop IP, hop port, MTU) of the next hop, None if there is no route
+        """
 
-        for route in self.route_list:
-            route = route.split(' ')
-            
-            port_low = int(route[1])
-            port_high = int(route[2])
-            if ip == route[0] and port in range(port_low, port_high + 1):
+        # Packets of one flow repeat the same (IP, port), so cache the
+        # resolved bucket and skip the bisect on repeats. The bucket is
+        # cached rather than the hop, so round-robin keeps rotating
 
-                hop_ip = route[3]
-                hop_port = int(route[4])
-                hop_mtu = int(route[5])
+        key = (ip, port)
+        route = self._route_cache.get(key)
 
-                # Move the route to the end of the list
-                self.route_list.remove(' '.join(route))
-                self.route_list.append(' '.join(route))
+        if route is None:
+            entry = self.routes_by_ip.get(ip)
+            if entry is None:
+                return None
 
-                return (hop_ip, hop_port, hop_mtu)
-        return None
+            # Find the last bucket starting at or below the port and
+            # check that the port falls inside it
+
+            los, routes = entry
+            idx = bisect_right(los, port) - 1
+            if idx < 0:
+                return None
+
+            route = routes[idx]
+            if port > route.hi:
+                return None
+
+            # Keep the cache bounded in case of garbage traffic
+
+            if len(self._route_cache) >= 4096:
+                self._route_cache.clear()
+            self._route_cache[key] = route
+
+        # Round-robin between the hops of the bucket with an O(1) deque
+        # rotation instead of list surgery
+
+        hops = route.hops
+        hop = hops[0]
+        hops.rotate(-1)
+        return hop
+
+    def forward_packet(self, packet: Packet, forward_address: tuple) -> None:
 
-    def forward_packet(self, packet: dict, forward_address: tuple) -> None:
-            
         """
         Forward a packet to the next hop
 
         Args:
-            packet (dict): Packet to forward
-        """        
-
-        # Create a packet from the dictionary
-
-        packet['TTL'] -= 1
+            packet (Packet): Packet to forward
+        """
 
-        packet = self.create_packet(packet)
+        # Decrement the TTL in place and serialize the packet
 
+        packet.TTL -= 1
 
         # Send the packet to the next hop
-        self.sock.sendto(packet.encode(), forward_address)
+        self.sock.sendto(self.create_packet(packet), forward_address)
 
-    def fragment_IP_packet(self, packet: dict, mtu: int) -> list:
+    def fragment_IP_packet(self, packet: Packet, mtu: int) -> list:
 
         """
         Fragment an IP packet if it's larger than the MTU
 
         Args:
-            packet (dict): Packet to fragment
+            packet (Packet): Packet to fragment
             mtu (int): MTU of the network
         Returns:
             list: List of fragments
         """
 
-        packet_str = self.create_packet(packet)
-        packet_size = len(packet_str.encode())
-        packet_list = packet_str.split(',')
+        # The header size is fixed, so whether the packet fits the MTU is
+        # known from the message length alone, before serializing anything
+
+        if HDR.size + len(packet.Message) <= mtu:
+            return [self.create_packet(packet)]
+
+        # Let the compiled loop build the fragments when it is available
+
+        if _fast_fragments is not None:
+            return _fast_fragments(packet.IP, packet.Port, packet.TTL, packet.ID,
+                                   packet.Offset, packet.Flag, packet.Message, mtu)
 
-        packet_headers = packet_list[:7]
-        packet_message = packet_list[7]
+        # The header has a fixed size, so every fragment carries chunk_size
+        # payload bytes. A memoryview over the message makes the payload
+        # slices zero-copy, and each fragment is assembled in one reused
+        # buffer with pack_into instead of concatenating header and
+        # payload allocations
 
-        header_size = len((','.join(packet_headers) + ',').encode())
-        message_size = len(packet_message.encode())
+        chunk_size = mtu - HDR.size
+
+        message = memoryview(packet.Message)
+        message_size = len(message)
+
+        buf = bytearray(mtu)
+        hdr_size = HDR.size
+        pack_into = HDR.pack_into
 
         fragments = []
 
-        offset = int(packet_headers[4])
-        flag = packet_headers[6]
+        for off in range(0, message_size, chunk_size):
+            end = off + chunk_size
+            piece = message[off:end]
+            piece_len = len(piece)
 
-        # If the packet is smaller than the MTU, return it in a list
+            # Only the last fragment keeps the packet's original flag
 
-        if packet_size <= mtu:
-            fragments.append(packet_str)
-        else:
-            while message_size > 0:
-                fragment = packet_headers.copy()
-                if message_size > mtu - header_size:
-                    fragment[4] = str(offset)
-                    
-                    # Update size so that its size is 8
-
-                    fragment[5] = str(mtu - header_size).zfill(8)
-
-                    fragment[6] = "1"
-                    fragment.append(packet_message[:mtu - header_size])
-                    fragments.append(','.join(fragment))
-
-                    packet_message = packet_message[mtu - header_size:]
-                    message_size = len(packet_message.encode())
-
-                    offset += mtu - header_size
-                else:
-                    fragment[4] = str(offset)
-                    fragment[5] = str(message_size).zfill(8)
-                    fragment[6] = flag
-                    fragment.append(packet_message)
-                    fragments.append(','.join(fragment))
-                    message_size = 0
+            pack_into(buf, 0, packet.IP, packet.Port, packet.TTL, packet.ID,
+                      packet.Offset + off, piece_len,
+                      packet.Flag if end >= message_size else 1)
+            buf[hdr_size:hdr_size + piece_len] = piece
+            fragments.append(bytes(memoryview(buf)[:hdr_size + piece_len]))
         return fragments
-       
-    def reassemble_IP_packet(self, fragments: list) -> dict:
-        
+
+    def forward_fragments(self, packet: Packet, forward_address: tuple, mtu: int) -> None:
+
         """
-        Reassemble an IP packet from a list of fragments
+        Fragment a packet as needed and send the burst to the next hop
 
         Args:
-            fragments (list): List of fragments
-        Returns:
-            dict: Reassembled packet
-        """   
+            packet (Packet): Packet to forward, TTL already decremented
+            forward_address (tuple): (IP, port) of the next hop
+            mtu (int): MTU of the outgoing network
+        """
+
+        # Packets that fit the MTU, and fragments from the compiled loop,
+        # are complete wire buffers and leave in one sendmmsg burst
+
+        if _fast_fragments is not None or HDR.size + len(packet.Message) <= mtu:
+            fragments = self.fragment_IP_packet(packet, mtu)
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("%sFragmented packet into %s%s", self.color, fragments, Style.RESET_ALL)
+            send_batch(self.sock, fragments, forward_address)
+            return
+
+        # Without the compiled loop, send each fragment as its packed
+        # header plus a memoryview slice of the message: sendmsg gathers
+        # the two buffers in the kernel, so the payload bytes are never
+        # copied in Python
+
+        chunk_size = mtu - HDR.size
+
+        message = memoryview(packet.Message)
+        message_size = len(message)
+
+        sendmsg = self.sock.sendmsg
+
+        for off in range(0, message_size, chunk_size):
+            end = off + chunk_size
+            piece = message[off:end]
 
-        fragments = [fragment.split(',') for fragment in fragments]
-        
-        # Sort the fragments by offset
+            # Only the last fragment keeps the packet's original flag
 
-        fragments.sort(key=lambda x: int(x[4]))
+            header = HDR.pack(packet.IP, packet.Port, packet.TTL, packet.ID,
+                              packet.Offset + off, len(piece),
+                              packet.Flag if end >= message_size else 1)
+            sendmsg((header, piece), (), 0, forward_address)
 
-        cur_offset = 0
-        message = ""
-        cur_size = 0
-        if (int(fragments[0][4]) != 0):
+    def reassemble_IP_packet(self, packet: Packet) -> Packet:
+
+        """
+        Fold a fragment into its packet's reassembly state
+
+        Args:
+            packet (Packet): Fragment that just arrived
+        Returns:
+            Packet: Reassembled packet, None if fragments are still missing
+        """
+
+        # Reject fragments whose header lies about the payload or claims
+        # an offset beyond any sane message, before any buffer is sized
+        # from those fields
+
+        if packet.Size != len(packet.Message) or packet.Offset + packet.Size > MAX_MESSAGE_SIZE:
+            log.debug("%sDropping fragment of packet %d with bad size fields%s",
+                      self.color, packet.ID, Style.RESET_ALL)
             return None
-        if (int(fragments[-1][6]) != 0):
+
+        now = time.monotonic()
+
+        # Sweep reassemblies whose fragments stopped arriving; deadlines
+        # are refreshed on every touch, so the least recently touched
+        # entries at the front expire first
+
+        fragment_dict = self.fragment_dict
+        while fragment_dict:
+            _, oldest = next(iter(fragment_dict.items()))
+            if oldest.deadline > now:
+                break
+            fragment_dict.popitem(last=False)
+
+        state = fragment_dict.get(packet.ID)
+        if state is None:
+            state = fragment_dict[packet.ID] = _Reassembly()
+
+            # Bound the number of in-flight reassemblies by dropping the
+            # least recently touched one
+
+            if len(fragment_dict) > MAX_INFLIGHT:
+                fragment_dict.popitem(last=False)
+        else:
+            fragment_dict.move_to_end(packet.ID)
+
+        state.deadline = now + REASSEMBLY_TIMEOUT
+
+        # Write the fragment into the buffer at its own offset; writes are
+        # position independent, so no sorting is needed and each fragment
+        # is handled exactly once
+
+        end = packet.Offset + packet.Size
+        if end > len(state.buffer):
+            state.buffer.extend(bytes(end - len(state.buffer)))
+        state.buffer[packet.Offset:end] = packet.Message
+        state.received_bytes += packet.Size
+
+        # The fragment with flag 0 is the last one of the packet
+
+        if packet.Flag == 0:
+            state.end_offset = end
+
+        # The packet is complete once the last fragment arrived and the
+        # received sizes add up to the end of the message
+
+        if state.end_offset is None or state.received_bytes != state.end_offset:
             return None
-        
-        print_with_color(f'Reassembling {len(fragments)} fragments', self.color)
-        
-        for fragment in fragments:
-            if int(fragment[4]) != cur_offset:
-                return None
-            message += fragment[7]
-            cur_offset += int(fragment[5])
-            cur_size += int(fragment[5])
-        
-        ret_packet = fragments[0][0:7]
-        ret_packet.append(message)
-        ret_packet[5] = str(cur_size).zfill(8)
-        ret_packet = ','.join(ret_packet)
-        return self.parse_packet(ret_packet.encode())
-        
-    def add_packet_to_dict(self, packet):
+
+        log.debug("%sReassembling packet %d%s", self.color, packet.ID, Style.RESET_ALL)
+        del self.fragment_dict[packet.ID]
+
+        # Reuse the last fragment's record for the reassembled packet
+
+        packet.Offset = 0
+        packet.Size = state.end_offset
+        packet.Flag = 0
+        packet.Message = bytes(state.buffer)
+        return packet
+
+    def handle_packet(self, data: bytes) -> None:
 
         """
-        Add a packet to the fragment dictionary based on its ID
+        Handle a single received datagram, forwarding or reassembling it
 
         Args:
-            packet (dict): Packet to add
-        """    
+            data (bytes): Raw datagram received from the socket
+        """
+
+        # Datagrams shorter than the wire header cannot carry valid
+        # fields, so drop them before unpacking
+
+        if len(data) < HDR.size:
+            log.debug("%sDropping truncated datagram of %d bytes%s", self.color, len(data), Style.RESET_ALL)
+            return
+
+        # Unpack only the header first; the message is not sliced out of
+        # the datagram until a branch actually needs it
+
+        ip, port, ttl, packet_id, offset, size, flag = self.peek_header(data)
+
+        # Gate the per-packet messages behind an explicit level check, so
+        # the arguments (inet_ntoa and friends) are never even built when
+        # DEBUG is off
+
+        debug = log.isEnabledFor(logging.DEBUG)
+
+        if debug:
+            log.debug("%sReceived packet for: %s:%d%s", self.color, socket.inet_ntoa(ip), port, Style.RESET_ALL)
+
+        # If the TTL is 0, drop the packet without touching the payload
+
+        if ttl == 0:
+            if debug:
+                log.debug("%sPacket has TTL = 0, discarding%s", self.color, Style.RESET_ALL)
+            return
+
+        # If the packet is for the router, reassemble and print it
+
+        if ip == self.ip_bytes and port == self.port:
+            packet = Packet(ip, port, ttl, packet_id, offset, size, flag, data[HDR.size:])
+            reassembled_packet = self.reassemble_IP_packet(packet)
+            if reassembled_packet:
+                log.info("%sReassembled packet %s%s", self.color, reassembled_packet.Message, Style.RESET_ALL)
 
-        if packet['ID'] not in self.fragment_dict:
-            self.fragment_dict[packet['ID']] = [self.create_packet(packet)]
         else:
-            self.fragment_dict[packet['ID']].append(self.create_packet(packet))
 
-    def run(self) -> None:
+            # Check if there is a route to the destination address
 
-        """
-        Main loop of the router. It waits for packets and forwards them if necessary
-        """        
+            route = self.check_routes(ip, port)
 
-        # Wait in a loop for packets
+            # If there is a route, forward the packet
 
-        while True:
-            packet, _ = self.sock.recvfrom(1024)
-            packet = self.parse_packet(packet)
+            if route:
+                route_mtu = route[2]
+                if debug:
+                    log.debug("%sRedirecting message for %s:%d to %s:%d, MTU is %d%s", self.color, socket.inet_ntoa(ip), port, route[0], route[1], route_mtu, Style.RESET_ALL)
 
-            print_with_color(f"Received packet for: {packet['IP']}:{packet['Port']}", self.color)
+                # A packet that already fits the MTU goes out as the
+                # received bytes with only the TTL byte rewritten, with
+                # no re-serialization at all
 
-            # If the TTL is 0, drop the packet
+                if len(data) <= route_mtu:
+                    buf = bytearray(data)
+                    buf[TTL_OFFSET] -= 1
+                    self.sock.sendto(buf, (route[0], route[1]))
+                    return
 
-            if packet['TTL'] == 0:
-                print_with_color("Packet has TTL = 0, discarding", self.color)
-                continue
+                if debug:
+                    log.debug("%sFragmenting packet with MTU %d%s", self.color, route_mtu, Style.RESET_ALL)
 
+                # Only here does the message get sliced out; it leaves in
+                # fragments with the TTL already decremented, in a single
+                # sendmmsg burst
+
+                packet = Packet(ip, port, ttl - 1, packet_id, offset, size, flag, data[HDR.size:])
+                self.forward_fragments(packet, (route[0], route[1]), route_mtu)
             else:
 
-                # If the packet is for the router, print it
+                # No route found, print the error
 
-                if packet['IP'] == self.ip and packet['Port'] == self.port:
-                    self.add_packet_to_dict(packet)
-                    reassembled_packet = self.reassemble_IP_packet(self.fragment_dict[packet['ID']])
-                    if reassembled_packet:
-                        print_with_color(f"Reassembled packet {reassembled_packet['Message']}", self.color)
-                        del self.fragment_dict[packet['ID']]
+                log.info("%sNo routes found to %s:%d%s", self.color, socket.inet_ntoa(ip), port, Style.RESET_ALL)
 
-                else:
+    def run(self) -> None:
 
-                    # Check if there is a route to the destination address
+        """
+        Main loop of the router. It waits for packets and forwards them if necessary
+        """
 
-                    route = self.check_routes(packet['IP'], int(packet['Port']))
+        # Wait in a loop for batches of packets. A malformed datagram
+        # must only cost itself, not the worker process, so errors are
+        # logged and the drain moves on to the next packet
 
-                    # If there is a route, forward the packet
+        while True:
+            for packet in self._batch.recv():
+                try:
+                    self.handle_packet(packet)
+                except Exception:
+                    log.exception("%sError handling packet%s", self.color, Style.RESET_ALL)
+
+
+class RouterProtocol(asyncio.DatagramProtocol):
 
-                    if route:
-                        print_with_color(f"Redirecting message for {packet['IP']}:{packet['Port']} to {route[0]}:{route[1]}, MTU is {route[2]}", self.color)
-                        route_mtu = route[2]
-                        print_with_color(f'Fragmenting packet with MTU {route_mtu}', self.color)
-                        fragments = self.fragment_IP_packet(packet, route_mtu)
-                        print_with_color(f'Fragmented packet into {fragments}', self.color)
-                        for fragment in fragments:
-                            packet = self.parse_packet(fragment.encode())
-                            self.forward_packet(packet, (route[0], route[1]))
-                    else:
+    """
+    Datagram protocol that feeds received packets to a Router. Running every
+    router on one event loop avoids a recvfrom-blocked thread per router
+    """
 
-                        # No route found, print the error
+    def __init__(self, router: Router) -> None:
+        self.router = router
+
+    def datagram_received(self, data: bytes, addr: tuple) -> None:
+        self.router.handle_packet(data)
 
-                        print_with_color(f"No routes found to {packet['IP']}:{packet['Port']}", self.color)
 
 if __name__ == "__main__":
     ip = sys.argv[1]
@@ -307,11 +630,3 @@ if __name__ == "__main__":
     table_path = sys.argv[3]
     r = Router(ip, port, table_path)
     r.run()
-    
-
-
-
-
-    
-
-    
\ No newline at end of file
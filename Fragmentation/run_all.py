@@ -1,22 +1,72 @@
 
 import router as r
-import threading as th
+import asyncio
 import sys
 
+from multiprocessing import Process
+
 from colorama import Fore
 
+# Use uvloop's libuv-based event loop when it is installed, which moves
+# recv/send scheduling out of the Python interpreter
+
+try:
+    import uvloop
+    uvloop.install()
+except ImportError:
+    pass
+
 
 colors = [Fore.RED, Fore.BLUE, Fore.GREEN, Fore.MAGENTA, Fore.YELLOW]
 
-def create_routers(num_routers):
+async def create_routers(num_routers):
+
+    # All routers share a single event loop instead of one blocked
+    # thread per router
+
+    loop = asyncio.get_running_loop()
+
     for i in range(1, num_routers + 1):
         router = r.Router("127.0.0.1", 8880 + i, f"rutas/rutas_R{i}_v3_mtu.txt", colors[i - 1])
-        thread = th.Thread(target=router.run, args=())
-        thread.start()
+        await loop.create_datagram_endpoint(lambda router=router: r.RouterProtocol(router), sock=router.sock)
+
+    await asyncio.Event().wait()
+
+def run_worker(index, port, table_path, color):
+
+    # Construct the router inside the worker process so its socket is
+    # bound there; SO_REUSEPORT (set in Router.__init__) lets every
+    # worker of a port bind it and the kernel shards flows between them
+
+    router = r.Router("127.0.0.1", port, table_path, color)
+
+    # Offset the round-robin state per worker so the shards of one
+    # router don't all start on the same hop
+
+    for _, routes in router.routes_by_ip.values():
+        for route in routes:
+            route.hops.rotate(-index)
+
+    router.run()
+
+def create_router_workers(num_routers, workers):
+
+    # One process per worker and per router, each with its own
+    # interpreter and GIL, scaling a router across cores
+
+    for i in range(1, num_routers + 1):
+        for w in range(workers):
+            process = Process(target=run_worker, args=(w, 8880 + i, f"rutas/rutas_R{i}_v3_mtu.txt", colors[i - 1]))
+            process.start()
 
 if __name__ == "__main__":
     num_router = int(sys.argv[1])
-    create_routers(num_router)
-    
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+
+    # With more than one worker per router, shard the routers across
+    # processes; otherwise run every router on a single event loop
 
-    
+    if workers > 1:
+        create_router_workers(num_router, workers)
+    else:
+        asyncio.run(create_routers(num_router))
@@ -0,0 +1,23 @@
+import sys
+import socket
+
+from random import randrange
+
+from router import HDR
+
+# Small helper to send a packet to a router, since the binary packet
+# header can no longer be typed into netcat by hand
+
+if __name__ == '__main__':
+    router_ip = sys.argv[1]
+    router_port = int(sys.argv[2])
+    dest_ip = sys.argv[3]
+    dest_port = int(sys.argv[4])
+    ttl = int(sys.argv[5])
+    message = sys.argv[6].encode()
+
+    packet = HDR.pack(socket.inet_aton(dest_ip), dest_port, ttl,
+                      randrange(1000), 0, len(message), 0) + message
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.sendto(packet, (router_ip, router_port))
@@ -0,0 +1,8 @@
+from setuptools import setup
+from Cython.Build import cythonize
+
+# Build the optional compiled fragment loop in place with
+#
+#   python setup_fast.py build_ext --inplace
+
+setup(ext_modules=cythonize('_fast.pyx', language_level=3))
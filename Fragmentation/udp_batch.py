@@ -0,0 +1,186 @@
+import ctypes
+import ctypes.util
+import socket
+
+# ctypes bindings for Linux recvmmsg and sendmmsg, which move a whole
+# batch of datagrams with a single syscall instead of one syscall per
+# packet
+
+class iovec(ctypes.Structure):
+    _fields_ = [
+        ('iov_base', ctypes.c_void_p),
+        ('iov_len', ctypes.c_size_t),
+    ]
+
+class msghdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_name', ctypes.c_void_p),
+        ('msg_namelen', ctypes.c_uint),
+        ('msg_iov', ctypes.POINTER(iovec)),
+        ('msg_iovlen', ctypes.c_size_t),
+        ('msg_control', ctypes.c_void_p),
+        ('msg_controllen', ctypes.c_size_t),
+        ('msg_flags', ctypes.c_int),
+    ]
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_hdr', msghdr),
+        ('msg_len', ctypes.c_uint),
+    ]
+
+class sockaddr_in(ctypes.Structure):
+    _fields_ = [
+        ('sin_family', ctypes.c_ushort),
+        ('sin_port', ctypes.c_uint16),
+        ('sin_addr', ctypes.c_ubyte * 4),
+        ('sin_zero', ctypes.c_char * 8),
+    ]
+
+# Return once at least one datagram has been received
+
+MSG_WAITFORONE = 0x10000
+
+# Default batch size, the number of preallocated receive buffers
+
+NUM_RCVMMSGS = 32
+
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    _recvmmsg = _libc.recvmmsg
+    _recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    _recvmmsg.restype = ctypes.c_int
+except (OSError, AttributeError, TypeError):
+    _recvmmsg = None
+
+try:
+    _sendmmsg = _libc.sendmmsg
+    _sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int]
+    _sendmmsg.restype = ctypes.c_int
+except (NameError, AttributeError):
+    _sendmmsg = None
+
+
+def send_batch(sock, datagrams: list, addr: tuple) -> None:
+
+    """
+    Send a list of datagrams to one address with a single sendmmsg syscall
+
+    Falls back to one sendto per datagram on platforms without sendmmsg
+
+    Args:
+        sock: Socket to send from
+        datagrams (list): Datagrams to send, each as bytes
+        addr (tuple): (IP, port) destination address
+    """
+
+    n = len(datagrams)
+
+    if _sendmmsg is None or n == 1:
+        for datagram in datagrams:
+            sock.sendto(datagram, addr)
+        return
+
+    # All fragments of a burst share one destination, so a single
+    # sockaddr is pointed to by every message header
+
+    sa = sockaddr_in(socket.AF_INET, socket.htons(addr[1]),
+                     (ctypes.c_ubyte * 4)(*socket.inet_aton(addr[0])))
+    sa_ptr = ctypes.cast(ctypes.pointer(sa), ctypes.c_void_p)
+    sa_len = ctypes.sizeof(sa)
+
+    bufs = [ctypes.create_string_buffer(datagram, len(datagram)) for datagram in datagrams]
+    iovecs = (iovec * n)()
+    hdrs = (mmsghdr * n)()
+
+    for i in range(n):
+        iovecs[i].iov_base = ctypes.cast(bufs[i], ctypes.c_void_p)
+        iovecs[i].iov_len = len(datagrams[i])
+        hdrs[i].msg_hdr.msg_iov = ctypes.pointer(iovecs[i])
+        hdrs[i].msg_hdr.msg_iovlen = 1
+        hdrs[i].msg_hdr.msg_name = sa_ptr
+        hdrs[i].msg_hdr.msg_namelen = sa_len
+
+    sent = _sendmmsg(sock.fileno(), hdrs, n, 0)
+
+    # On any error or partial send, finish with sendto so no fragment
+    # is silently dropped
+
+    if sent < 0:
+        sent = 0
+    for datagram in datagrams[sent:]:
+        sock.sendto(datagram, addr)
+
+
+class BatchReceiver:
+
+    """
+    Receive batches of datagrams with a single recvmmsg syscall.
+
+    The receive buffers and syscall structures are allocated once at
+    construction, so each batch only pays for the syscall and for slicing
+    out the received datagrams. Falls back to a plain recvfrom on
+    platforms without recvmmsg
+    """
+
+    def __init__(self, sock, batchsize: int = NUM_RCVMMSGS, bufsize: int = 1024) -> None:
+
+        """
+        Preallocate the receive buffers and recvmmsg structures
+
+        Args:
+            sock: Socket to receive from
+            batchsize (int): Maximum number of datagrams per batch
+            bufsize (int): Buffer size for each datagram
+        """
+
+        self.sock = sock
+        self.batchsize = batchsize
+        self.bufsize = bufsize
+
+        self._bufs = [ctypes.create_string_buffer(bufsize) for _ in range(batchsize)]
+        self._views = [memoryview(buf) for buf in self._bufs]
+        self._iovecs = (iovec * batchsize)()
+        self._hdrs = (mmsghdr * batchsize)()
+
+        # Reused receive buffer for the recvfrom fallback, so the kernel
+        # copies into the same memory every time
+
+        self._rx_buf = bytearray(bufsize)
+        self._rx_view = memoryview(self._rx_buf)
+
+        for i in range(batchsize):
+            self._iovecs[i].iov_base = ctypes.cast(self._bufs[i], ctypes.c_void_p)
+            self._iovecs[i].iov_len = bufsize
+            self._hdrs[i].msg_hdr.msg_iov = ctypes.pointer(self._iovecs[i])
+            self._hdrs[i].msg_hdr.msg_iovlen = 1
+
+    def recv(self) -> list:
+
+        """
+        Receive up to batchsize datagrams with one syscall
+
+        Blocks until at least one datagram is available
+
+        Returns:
+            list: List of received datagrams as bytes
+        """
+
+        if _recvmmsg is None:
+            n, _ = self.sock.recvfrom_into(self._rx_buf)
+            return [bytes(self._rx_view[:n])]
+
+        count = _recvmmsg(self.sock.fileno(), self._hdrs, self.batchsize, MSG_WAITFORONE, None)
+
+        # On any error fall back to recvfrom so the router keeps running
+
+        if count < 0:
+            n, _ = self.sock.recvfrom_into(self._rx_buf)
+            return [bytes(self._rx_view[:n])]
+
+        # Slice each datagram out through a memoryview, copying only the
+        # received bytes instead of the whole buffer
+
+        hdrs = self._hdrs
+        views = self._views
+        return [bytes(views[i][:hdrs[i].msg_len]) for i in range(count)]